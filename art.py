@@ -1,42 +1,178 @@
+import argparse
+import atexit
+import csv
+import functools
+import getpass
+import hashlib
+import json
 import logging
+import logging.handlers
+import mmap
+import os
+import queue
+import re
+import sqlite3
+import struct
+import threading
 import time
 import webbrowser
+from collections import Counter, OrderedDict, defaultdict, deque
 from datetime import datetime
 from pathlib import Path
-from random import choice, randint, random, sample
+from random import Random
 
-import dataframe_image as dfi
-import pandas as pd
+import numpy as np
 from webcolors import hex_to_rgb
 from yaml import SafeLoader, load
 
 import pygame
 
+from rules import GLITCH_TIME, GameState
 
-def maxdiff(a, b):
-    return(max([a-b for a, b in zip(a, b)]))
 
+class Profiler():
+    # named spans aggregated into power of two microsecond histograms
+    def __init__(self, trace_limit=1000000, interval=10):
+        self.enabled = False
+        self.histograms = defaultdict(lambda: [0] * 32)
+        self.totals = Counter()
+        self.counters = Counter()
+        self.trace = None
+        self.trace_limit = trace_limit
+        self.interval = interval
+        self.origin = time.perf_counter()
+        self.last_report = self.origin
 
-def rgb_to_greyscale(rgb):
-    average = 0.299*rgb[0] + 0.587*rgb[1] + 0.114*rgb[2]
-    return([average, average, average])
+    def enable(self, trace=False):
+        self.enabled = True
+        if trace:
+            self.trace = deque(maxlen=self.trace_limit)
 
+    def record(self, name, start, duration):
+        microseconds = int(duration * 1e6)
+        self.histograms[name][min(microseconds.bit_length(), 31)] += 1
+        self.totals[name] += microseconds
+        if self.trace is not None:
+            self.trace.append((name, start, duration, threading.get_ident()))
 
-class Heart(pygame.sprite.Sprite):
-    def __init__(self, x, y):
-        super().__init__()
-        pygame.init()
-        heart = pygame.image.load('assets/heart.png')
-        broken_heart = pygame.image.load('assets/broken_heart.png')
-        self.heart = pygame.transform.scale(heart, (25, 25))
-        self.broken_heart = pygame.transform.scale(broken_heart, (25, 25))
-        self.bug_assets = {}
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def percentile(self, name, fraction):
+        histogram = self.histograms[name]
+        target = fraction * sum(histogram)
+        seen = 0
+        for bucket, calls in enumerate(histogram):
+            seen += calls
+            if calls and seen >= target:
+                return 1 << bucket
+        return 0
+
+    def summary(self):
+        lines = [f"{'span':<16}{'calls':>8}{'mean us':>10}{'p50 us':>9}{'p99 us':>9}"]
+        for name, histogram in sorted(self.histograms.items()):
+            calls = sum(histogram)
+            lines.append(f"{name:<16}{calls:>8}{self.totals[name] // calls:>10}"
+                         f"{self.percentile(name, 0.5):>9}"
+                         f"{self.percentile(name, 0.99):>9}")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<16}{value:>8}")
+        return '\n'.join(lines)
+
+    def report(self):
+        # periodic summary, checked once per frame
+        now = time.perf_counter()
+        if self.enabled and now - self.last_report > self.interval:
+            self.last_report = now
+            logging.info(f"profile\n{self.summary()}")
+
+    def write_trace(self, path):
+        events = [{'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': thread,
+                   'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6}
+                  for name, start, duration, thread in self.trace]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+
+
+profiler = Profiler()
+
+
+def profiled(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.record(name, start, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def setup_logging(file_name='debug.log'):
+    # the game thread only enqueues records, a listener thread writes them
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        records, logging.FileHandler(file_name, mode='w'))
+    logging.basicConfig(level=logging.DEBUG,
+                        handlers=[logging.handlers.QueueHandler(records)])
+    listener.start()
+    atexit.register(listener.stop)
+
+
+class ImageRegistry():
+    # decoded, scaled and converted images shared by every sprite; images
+    # nobody holds any more are evicted least recently used first
+    def __init__(self, capacity=16):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def acquire(self, path, size):
+        key = (path, size)
+        if key not in self.entries:
+            image = pygame.transform.scale(pygame.image.load(path), size)
+            if pygame.display.get_surface():
+                image = image.convert_alpha()
+            self.entries[key] = [image, 0]
+        self.entries.move_to_end(key)
+        self.entries[key][1] += 1
+        self.evict()
+        return self.entries[key][0]
+
+    def release(self, path, size):
+        self.entries[(path, size)][1] -= 1
+        self.evict()
+
+    def evict(self):
+        unused = [key for key, (_, refs) in self.entries.items() if refs == 0]
+        while len(self.entries) > self.capacity and unused:
+            del self.entries[unused.pop(0)]
+
+
+images = ImageRegistry()
+
+
+class Heart():
+    __slots__ = ('heart', 'broken_heart', 'image', 'rect', 'speed')
+    size = (25, 25)
+
+    def __init__(self, x, y, rng):
+        self.heart = images.acquire('assets/heart.png', self.size)
+        self.broken_heart = images.acquire('assets/broken_heart.png',
+                                           self.size)
         self.image = self.heart
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
-        self.last_move = time.time()
-        self.speed = [choice([-1, 1]), choice([-1, 1])]
+        self.speed = [rng.choice([-1, 1]), rng.choice([-1, 1])]
+
+    def kill(self):
+        images.release('assets/heart.png', self.size)
+        images.release('assets/broken_heart.png', self.size)
 
     def break_heart(self):
         self.image = self.broken_heart
@@ -47,244 +183,1031 @@ class Heart(pygame.sprite.Sprite):
     def draw(self, screen):
         screen.blit(self.image, self.rect)
 
-    def move(self, width, height):
-        if time.time() - self.last_move > 0.01:
-            if self.rect.x <= 0 or self.rect.x >= width - self.rect.width:
-                self.speed[0] = -self.speed[0]
-            if self.rect.y <= 0 or self.rect.y >= height - self.rect.height:
-                self.speed[1] = -self.speed[1]
-            self.rect.x += self.speed[0]
-            self.rect.y += self.speed[1]
-            self.last_move = time.time()
-
     def move_to(self, x, y):
         self.rect.x = x
         self.rect.y = y
 
 
-class Block(pygame.sprite.Sprite):
-    def __init__(self, color, width, height, x, y, color_axis):
-        super().__init__()
-        self.image = pygame.Surface([width, height])
-        self.foreground = list(color)
-        self.update_foreground()
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
-        self.color_axis = color_axis
-        self.greyscaleflag = False
-
-    def update_foreground(self):
-        logging.debug(f"Updating foreground to {self.foreground}")
-        for i, value in enumerate(self.foreground):
-            if value >= 254:
-                self.foreground[i] = 254
-            elif value <= 0:
-                self.foreground[i] = 0
-        self.image.fill(self.foreground)
+class Swarm():
+    # floating sprites moved together, positions in px and velocities in px/s
+    def __init__(self, speed=100):
+        self.speed = speed
+        self.sprites = []
+        self.position = np.empty((0, 2))
+        self.velocity = np.empty((0, 2))
+        self.size = np.empty((0, 2))
 
-    def draw(self, screen):
-        screen.blit(self.image, self.rect)
+    def __len__(self):
+        return len(self.sprites)
 
-    def change_color(self, step):
-        if self.greyscaleflag:
-            self.foreground = [i + step for i in self.foreground]
-        else:
-            self.foreground[self.color_axis] += step
-        self.update_foreground()
+    def __iter__(self):
+        return iter(self.sprites)
+
+    def add(self, sprite):
+        self.sprites.append(sprite)
+        self.position = np.vstack([self.position, sprite.rect.topleft])
+        self.velocity = np.vstack([self.velocity,
+                                   np.multiply(sprite.speed, self.speed)])
+        self.size = np.vstack([self.size, sprite.rect.size])
+
+    def remove(self, index):
+        self.position = np.delete(self.position, index, axis=0)
+        self.velocity = np.delete(self.velocity, index, axis=0)
+        self.size = np.delete(self.size, index, axis=0)
+        return self.sprites.pop(index)
+
+    def update(self, dt, width, height):
+        # one integration step for every sprite, bouncing off the walls;
+        # returns the regions that changed
+        old = self.position.astype(int)
+        self.position += self.velocity * dt / 1000
+        limit = np.array([width, height]) - self.size
+        self.velocity = np.where(self.position <= 0,
+                                 np.abs(self.velocity), self.velocity)
+        self.velocity = np.where(self.position >= limit,
+                                 -np.abs(self.velocity), self.velocity)
+        np.clip(self.position, 0, limit, out=self.position)
+        new = self.position.astype(int)
+        moved = np.flatnonzero((old != new).any(axis=1))
+        low = np.minimum(old[moved], new[moved])
+        high = np.maximum(old[moved], new[moved]) + self.size[moved].astype(int)
+        for i, (x, y) in zip(moved.tolist(), new[moved].tolist()):
+            self.sprites[i].rect.topleft = (x, y)
+        return [pygame.Rect(x0, y0, x1 - x0, y1 - y0)
+                for (x0, y0), (x1, y1) in zip(low.tolist(), high.tolist())]
+
+    def hit(self, point):
+        inside = ((self.position <= point) &
+                  (point < self.position + self.size)).all(axis=1)
+        hits = np.flatnonzero(inside)
+        return int(hits[0]) if len(hits) else None
+
+
+class Block():
+    # where a palette color is shown, the color itself lives in GameState
+    __slots__ = ('rect',)
+
+    def __init__(self, width, height, x, y):
+        self.rect = pygame.Rect(x, y, width, height)
+
+    def draw(self, screen, color):
+        screen.fill(color, self.rect)
 
     def move(self, newX, newY):
         self.rect.x = newX
         self.rect.y = newY
 
-    def greyscale(self):
-        self.foreground = rgb_to_greyscale(self.foreground)
-        self.image.fill(self.foreground)
-        self.greyscaleflag = True
 
+def image_size(path):
+    # width and height from the file header, without decoding the pixels
+    with open(path, 'rb') as f:
+        data = f.read(24)
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            return struct.unpack('>II', data[16:24])
+        if data[:2] == b'\xff\xd8':
+            f.seek(2)
+            while True:
+                marker, length = struct.unpack('>2sH', f.read(4))
+                if marker[1] in (0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7,
+                                 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf):
+                    height, width = struct.unpack('>xHH', f.read(5))
+                    return width, height
+                f.seek(length - 2, 1)
+    return pygame.image.load(path).get_size()
 
-class Level():
-    def __init__(self, file_name):
+
+def modified(path):
+    path = Path(path)
+    return path.stat().st_mtime if path.exists() else None
+
+
+def compile_manifest(directory='levels', manifest='.cache/levels.json'):
+    # level metadata compiled once, rebuilt when any level file or any
+    # artwork it references changes (the artwork sizes are cached too)
+    sources = {str(path): path.stat().st_mtime
+               for path in sorted(Path(directory).glob('*.yml'))}
+    manifest = Path(manifest)
+    if manifest.exists():
+        compiled = json.loads(manifest.read_text())
+        if compiled['sources'] == sources and 'images' in compiled and all(
+                modified(image) == mtime
+                for image, mtime in compiled['images'].items()):
+            return compiled['levels']
+    levels = []
+    images = {}
+    for file_name in sources:
         with open(file_name) as f:
             data = load(f, Loader=SafeLoader)
-            self.title = data['title']
-            self.url = data['url']
-            if 'image' in data:
-                self.image = pygame.image.load(data['image'])
-                self.width = self.image.get_width()
-                self.height = self.image.get_height()
-            self.colors = [hex_to_rgb(
-                color) for color in data['colors']]
+        entry = {'title': data['title'], 'url': data['url'],
+                 'colors': data['colors']}
+        if 'image' in data:
+            entry['image'] = data['image']
+            entry['width'], entry['height'] = image_size(data['image'])
+            images[data['image']] = modified(data['image'])
+        levels.append(entry)
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    manifest.write_text(json.dumps({'sources': sources, 'images': images,
+                                    'levels': levels}))
+    return levels
+
+
+def load_scaled(path, size, alpha=False, smooth=False,
+                cache_dir=Path('.cache/assets')):
+    # decoded and scaled pixels are cached by source hash and target size
+    data = Path(path).read_bytes()
+    key = hashlib.sha1(data).hexdigest()
+    mode = 'RGBA' if alpha else 'RGB'
+    flag = 's' if smooth else ''
+    cached = cache_dir / f"{key}_{size[0]}x{size[1]}{flag}.{mode.lower()}"
+    if cached.exists():
+        with open(cached, 'rb') as f:
+            pixels = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return pygame.image.frombuffer(pixels, size, mode)
+    image = pygame.image.load(path)
+    if smooth:
+        scaled = pygame.transform.smoothscale(image.convert(24), size)
+    else:
+        scaled = pygame.transform.scale(image, size)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    partial = cached.with_suffix('.part')
+    partial.write_bytes(pygame.image.tobytes(scaled, mode))
+    partial.replace(cached)
+    return scaled
+
+
+class Level():
+    def __init__(self, entry):
+        self.title = entry['title']
+        self.url = entry['url']
+        self.image_file = entry.get('image')
+        if self.image_file:
+            self.width = entry['width']
+            self.height = entry['height']
+        self.colors = [hex_to_rgb(
+            color) for color in entry['colors']]
+        self.loaded = {}
+        self.loader = None
+
+    def size_within(self, box):
+        # largest size fitting the box with the same aspect, never enlarged
+        scale = min(1, box[0] / self.width, box[1] / self.height)
+        return (round(self.width * scale), round(self.height * scale))
+
+    def load(self, size):
+        self.loaded[size] = load_scaled(self.image_file, size, smooth=True)
+
+    def prefetch(self, box):
+        if not self.image_file:
+            return
+        size = self.size_within(box)
+        if size not in self.loaded and self.loader is None:
+            self.loader = threading.Thread(target=self.load, args=(size,),
+                                           daemon=True)
+            self.loader.start()
+
+    def artwork(self, box):
+        if self.loader:
+            self.loader.join()
+            self.loader = None
+        size = self.size_within(box)
+        if size not in self.loaded:
+            self.load(size)
+        return self.loaded[size]
+
+    def thumbnail(self, box=(160, 120)):
+        return self.artwork(box)
+
+    def unload(self):
+        if self.loader:
+            self.loader.join()
+            self.loader = None
+        self.loaded = {}
+
+
+class AudioBank():
+    # decoded PCM cached on disk in the mixer's format, so compressed clips
+    # are decoded once; short clips stay in memory and long ones are streamed
+    # from the cache file in chunks. Clips play on a fixed pool of reserved
+    # channels, a full pool gives up its lowest priority, oldest voice.
+    def __init__(self, voices=4, cache_dir='.cache/audio', stream_after=2.0,
+                 chunk=0.25):
+        self.cache_dir = Path(cache_dir)
+        self.stream_after = stream_after
+        self.clips = {}
+        self.streams = {}
+        self.sequence = 0
+        frequency, size, channels = pygame.mixer.get_init()
+        self.format = f"{frequency}_{size}_{channels}"
+        self.frame_bytes = abs(size) // 8 * channels
+        self.bytes_per_second = frequency * self.frame_bytes
+        self.chunk = int(chunk * frequency) * self.frame_bytes
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), voices))
+        pygame.mixer.set_reserved(voices)
+        self.channels = [pygame.mixer.Channel(i) for i in range(voices)]
+        self.owners = [(0, 0)] * voices
+
+    def pcm_file(self, path):
+        data = Path(path).read_bytes()
+        cached = self.cache_dir / f"{hashlib.sha1(data).hexdigest()}_{self.format}.pcm"
+        if not cached.exists():
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            partial = cached.with_suffix('.part')
+            partial.write_bytes(pygame.mixer.Sound(path).get_raw())
+            partial.replace(cached)
+        return cached
+
+    def load(self, name, path, priority=0):
+        cached = self.pcm_file(path)
+        if cached.stat().st_size > self.stream_after * self.bytes_per_second:
+            with open(cached, 'rb') as f:
+                pcm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.clips[name] = (None, pcm, priority)
+        else:
+            sound = pygame.mixer.Sound(buffer=cached.read_bytes())
+            self.clips[name] = (sound, None, priority)
+
+    def voice(self, priority):
+        for index, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                return index
+        index = min(range(len(self.channels)), key=self.owners.__getitem__)
+        if self.owners[index][0] > priority:
+            return None
+        self.channels[index].stop()
+        self.streams.pop(index, None)
+        return index
+
+    def play(self, name):
+        sound, pcm, priority = self.clips[name]
+        index = self.voice(priority)
+        if index is None:
+            return
+        self.sequence += 1
+        self.owners[index] = (priority, self.sequence)
+        self.streams.pop(index, None)
+        if sound:
+            self.channels[index].play(sound)
+        else:
+            self.channels[index].play(pygame.mixer.Sound(buffer=pcm[:self.chunk]))
+            self.streams[index] = [pcm, self.chunk]
+            self.update()
+
+    def update(self):
+        # keep one chunk queued behind the playing one on every stream
+        for index, stream in list(self.streams.items()):
+            pcm, offset = stream
+            channel = self.channels[index]
+            if offset >= len(pcm):
+                if not channel.get_busy():
+                    del self.streams[index]
+            elif channel.get_queue() is None:
+                channel.queue(pygame.mixer.Sound(
+                    buffer=pcm[offset:offset + self.chunk]))
+                stream[1] = offset + self.chunk
+
+    def streaming(self):
+        return bool(self.streams)
+
+
+class AssetManager():
+    def __init__(self, audio, cache_dir='.cache/assets'):
+        self.audio = audio
+        self.cache_dir = Path(cache_dir)
+        self.images = []
+        self.sound_files = []
+        self.surfaces = {}
+        self.error = None
+        self.thread = None
+
+    def add_image(self, name, path, size, alpha=False):
+        self.images.append((name, path, size, alpha))
+
+    def add_sound(self, name, path, priority=0):
+        self.sound_files.append((name, path, priority))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.load_all, daemon=True)
+        self.thread.start()
+
+    def load_all(self):
+        try:
+            for name, path, size, alpha in self.images:
+                self.surfaces[name] = load_scaled(
+                    path, size, alpha, cache_dir=self.cache_dir)
+            for name, path, priority in self.sound_files:
+                self.audio.load(name, path, priority)
+        except Exception as error:
+            self.error = error
+
+    def result(self):
+        self.thread.join()
+        if self.error:
+            raise self.error
+        assets = {}
+        for name, path, size, alpha in self.images:
+            surface = self.surfaces[name]
+            # convert to the display format once instead of on every blit
+            assets[name] = surface.convert_alpha() if alpha else surface.convert()
+        return assets
+
+
+class Noise():
+    # tv static like the old 640x480 noise frames: grey noise smeared along
+    # each scanline, mixed a little with the lines above and below, on top
+    # of a brightness that drifts from line to line. Uniform noise is much
+    # cheaper to draw and ends up close to normal once smeared.
+    def __init__(self, size, source=(640, 480), mean=86, deviation=50,
+                 smear=0.88, line_share=0.15, line_smear=0.8, steps=6):
+        self.size = size
+        self.mean = mean
+        self.smear = smear
+        self.line_smear = line_smear
+        self.steps = steps
+        width, height = source
+        self.small = pygame.Surface(source, depth=32)
+        self.frame = pygame.Surface(size)
+        self.noise = np.empty((width, height + 2), dtype=np.float32)
+        self.lines = np.empty(height, dtype=np.float32)
+        self.rng = np.random.default_rng()
+        # uniform noise has a variance of 1/12, smearing multiplies it and the
+        # 1 3 1 line mix adds up to 11 times that
+        self.noise_scale = deviation * np.sqrt(12 * (1 - line_share) / (
+            11 * self.smeared_variance(smear)))
+        self.line_scale = deviation * np.sqrt(
+            12 * line_share / self.smeared_variance(line_smear))
+
+    def smeared_variance(self, factor):
+        return (1 - factor ** (2 ** (self.steps + 1))) / (1 - factor ** 2)
+
+    def smear_along(self, values, factor):
+        # values[n] becomes the sum of factor**j * values[n - j] for
+        # j < 2**steps, doubling the reach with every pass
+        for step in (2 ** i for i in range(self.steps)):
+            values[step:] += factor ** step * values[:-step]
+
+    def next_frame(self):
+        self.rng.random(dtype=np.float32, out=self.noise)
+        self.rng.random(dtype=np.float32, out=self.lines)
+        self.noise -= 0.5
+        self.lines -= 0.5
+        self.smear_along(self.noise, self.smear)
+        self.smear_along(self.lines, self.line_smear)
+        values = self.noise[:, :-2] + 3 * self.noise[:, 1:-1] + self.noise[:, 2:]
+        values *= self.noise_scale
+        values += self.line_scale * self.lines + self.mean
+        np.clip(values, 0, 255, out=values)
+        # the same byte in every channel is grey in any channel order
+        pixels = pygame.surfarray.pixels2d(self.small)
+        pixels[...] = values.astype(np.uint32) * 0x010101
+        del pixels
+        return pygame.transform.smoothscale(self.small, self.size, self.frame)
+
+
+class TextCache():
+    # rendered text surfaces, least recently used dropped over the budget
+    def __init__(self, budget=4 * 1024 * 1024):
+        self.budget = budget
+        self.used = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, antialias, color, background=None):
+        key = (font, text, antialias, tuple(color),
+               background and tuple(background))
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        surface = font.render(text, antialias, color, background)
+        self.entries[key] = surface
+        self.used += self.surface_bytes(surface)
+        while self.used > self.budget and len(self.entries) > 1:
+            _, dropped = self.entries.popitem(last=False)
+            self.used -= self.surface_bytes(dropped)
+        return surface
+
+    def surface_bytes(self, surface):
+        return surface.get_pitch() * surface.get_height()
+
+
+class StatsRecorder():
+    # per-level results of one session in typed arrays that grow by doubling
+    def __init__(self, capacity=16):
+        self.count = 0
+        self.levels = []
+        self.accuracy = np.empty(capacity, dtype=np.float64)
+        self.speed = np.empty(capacity, dtype=np.float64)
+        self.level_order = np.empty(capacity, dtype=np.int32)
+
+    def __len__(self):
+        return self.count
+
+    def record(self, level, accuracy, speed, level_order):
+        if self.count == len(self.accuracy):
+            self.accuracy = np.resize(self.accuracy, 2 * self.count)
+            self.speed = np.resize(self.speed, 2 * self.count)
+            self.level_order = np.resize(self.level_order, 2 * self.count)
+        self.levels.append(level)
+        self.accuracy[self.count] = accuracy
+        self.speed[self.count] = speed
+        self.level_order[self.count] = level_order
+        self.count += 1
+
+    def rows(self):
+        return list(zip(self.levels,
+                        self.accuracy[:self.count].tolist(),
+                        self.speed[:self.count].tolist(),
+                        self.level_order[:self.count].tolist()))
+
+
+class StatsStore():
+    schema_version = 1
+    schema = ('''CREATE TABLE IF NOT EXISTS sessions (
+                     id INTEGER PRIMARY KEY,
+                     player TEXT NOT NULL,
+                     started TEXT NOT NULL)''',
+              '''CREATE TABLE IF NOT EXISTS levels (
+                     session INTEGER NOT NULL REFERENCES sessions(id),
+                     level TEXT NOT NULL,
+                     accuracy REAL NOT NULL,
+                     speed REAL NOT NULL,
+                     level_order INTEGER NOT NULL)''',
+              'CREATE INDEX IF NOT EXISTS sessions_player ON sessions(player, started)',
+              'CREATE INDEX IF NOT EXISTS levels_session ON levels(session)',
+              'CREATE INDEX IF NOT EXISTS levels_accuracy ON levels(level, accuracy)',
+              'CREATE INDEX IF NOT EXISTS levels_speed ON levels(level, speed)')
+
+    def __init__(self, path, legacy_csv=None, player=None):
+        self.connection = sqlite3.connect(path)
+        self.migrate(legacy_csv, player or getpass.getuser())
+
+    def migrate(self, legacy_csv, player):
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.schema_version:
+            return
+        # the tables, the csv import and the version bump commit together,
+        # a failure leaves the database as it was for the next attempt
+        self.connection.execute('BEGIN')
+        try:
+            if version < 1:
+                for statement in self.schema:
+                    self.connection.execute(statement)
+                # a new database takes over the history of the old csv file once
+                if legacy_csv and Path(legacy_csv).exists():
+                    self.import_csv(legacy_csv, player)
+            self.connection.execute(f'PRAGMA user_version = {self.schema_version}')
+        except BaseException:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+
+    def import_csv(self, path, player):
+        # the csv has no sessions, each one started again at level order 0
+        started = datetime.fromtimestamp(
+            Path(path).stat().st_mtime).isoformat(timespec='seconds')
+        skipped = 0
+        with open(path, newline='') as f:
+            session = None
+            for row in csv.DictReader(f):
+                try:
+                    level = (row['level'], float(row['accuracy']),
+                             float(row['speed']), int(float(row['level_order'])))
+                except (KeyError, TypeError, ValueError):
+                    skipped += 1
+                    continue
+                if session is None or level[3] == 0:
+                    session = self.connection.execute(
+                        'INSERT INTO sessions (player, started) VALUES (?, ?)',
+                        (player, started)).lastrowid
+                self.connection.execute(
+                    'INSERT INTO levels VALUES (?, ?, ?, ?, ?)', (session, *level))
+        if skipped:
+            logging.warning(f"Skipped {skipped} malformed rows of {path}")
+
+    def save(self, player, started, recorder):
+        # one transaction per session, nothing to keep if no level was played
+        if len(recorder) == 0:
+            return
+        with self.connection:
+            session = self.connection.execute(
+                'INSERT INTO sessions (player, started) VALUES (?, ?)',
+                (player, started)).lastrowid
+            self.connection.executemany(
+                'INSERT INTO levels VALUES (?, ?, ?, ?, ?)',
+                [(session, *row) for row in recorder.rows()])
+
+    def best_accuracy(self):
+        return self.connection.execute(
+            'SELECT level, MAX(accuracy) FROM levels GROUP BY level').fetchall()
+
+    def speed_percentile(self, level, percentile):
+        total = self.connection.execute(
+            'SELECT COUNT(*) FROM levels WHERE level = ?', (level,)).fetchone()[0]
+        if total == 0:
+            return None
+        return self.connection.execute(
+            'SELECT speed FROM levels WHERE level = ? ORDER BY speed LIMIT 1 OFFSET ?',
+            (level, round(percentile / 100 * (total - 1)))).fetchone()[0]
+
+    def player_history(self, player):
+        return self.connection.execute(
+            '''SELECT sessions.started, level, accuracy, speed, level_order
+               FROM sessions JOIN levels ON levels.session = sessions.id
+               WHERE player = ?
+               ORDER BY sessions.started, sessions.id, level_order''',
+            (player,)).fetchall()
+
+    def summary(self, player):
+        lines = [f"{'level':<34}{'best %':>8}{'p50 s':>8}{'p90 s':>8}"]
+        for level, accuracy in sorted(self.best_accuracy()):
+            lines.append(f"{level[:33]:<34}{accuracy:>8.1f}"
+                         f"{self.speed_percentile(level, 50):>8.2f}"
+                         f"{self.speed_percentile(level, 90):>8.2f}")
+        lines.append(f"\nhistory of {player}")
+        for started, level, accuracy, speed, level_order in self.player_history(player):
+            lines.append(f"{started}  {level_order}  {level[:33]:<34}"
+                         f"{accuracy:>8.1f}{speed:>8.2f}")
+        return '\n'.join(lines)
+
+    def close(self):
+        self.connection.close()
+
+
+JOB_DONE = pygame.event.custom_type()
+
+
+class Worker():
+    # a few threads for blocking side effects, completion comes back to the
+    # game loop as a JOB_DONE event
+    def __init__(self, threads=2, queue_size=16):
+        self.jobs = queue.Queue(queue_size)
+        self.threads = [threading.Thread(target=self.work, daemon=True)
+                        for _ in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, name, function, *args):
+        # never block the frame loop, a full queue drops the job
+        try:
+            self.jobs.put_nowait((name, function, args))
+        except queue.Full:
+            logging.warning(f"Job {name} dropped, the worker queue is full")
+            return False
+        return True
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            name, function, args = job
+            result, error = None, None
+            try:
+                result = function(*args)
+            except Exception as exception:
+                logging.exception(f"Job {name} failed")
+                error = exception
+            if pygame.get_init():
+                pygame.event.post(pygame.event.Event(
+                    JOB_DONE, name=name, result=result, error=error))
+
+    def shutdown(self):
+        # queued jobs run before the threads see the stop marker
+        for thread in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class Effect():
+    # time sliced animation advanced by the frame loop, times in ms
+    def __init__(self, duration):
+        self.duration = duration
+        self.started = 0
+        self.elapsed = 0
+        self.queued = 0
+
+    def start(self, now):
+        self.started = now
+        self.queued = time.perf_counter()
+
+    def update(self, now):
+        self.elapsed = now - self.started
+        return self.elapsed < self.duration
+
+    def draw(self, screen):
+        pass
+
+
+class Overlay(Effect):
+    def __init__(self, image, duration):
+        super().__init__(duration)
+        self.image = image
+
+    def draw(self, screen):
+        screen.blit(self.image, (0, 0))
+
+
+class Static(Effect):
+    def __init__(self, noise, duration, frame_time=50):
+        super().__init__(duration)
+        self.noise = noise
+        self.frame_time = frame_time
+        self.shown = -1
+
+    def draw(self, screen):
+        frame = self.elapsed // self.frame_time
+        if frame != self.shown:
+            self.shown = frame
+            self.noise.next_frame()
+        screen.blit(self.noise.frame, (0, 0))
+
+
+class Timeline():
+    def __init__(self):
+        self.effects = []
+
+    def add(self, effect, now):
+        effect.start(now)
+        self.effects.append(effect)
+
+    def active(self):
+        return bool(self.effects)
+
+    def update(self, now):
+        running = []
+        for effect in self.effects:
+            if effect.update(now):
+                running.append(effect)
+            elif profiler.enabled:
+                # one span per effect, from queued to taken off the screen
+                profiler.record(type(effect).__name__.lower(), effect.queued,
+                                time.perf_counter() - effect.queued)
+        self.effects = running
+
+    def draw(self, screen):
+        for effect in self.effects:
+            effect.draw(screen)
+
+
+class Scheduler():
+    def __init__(self, fps=60, idle_timeout=1000):
+        self.fps = fps
+        self.idle_timeout = idle_timeout
+        self.clock = pygame.time.Clock()
+        self.dt = 0
+        self.time = pygame.time.get_ticks()
+
+    def now(self):
+        # the same time for everything done in one frame
+        return self.time
+
+    def next_events(self, animating=False, deadline=None):
+        if animating:
+            # fixed timestep while something moves on screen
+            self.dt = self.clock.tick(self.fps)
+            events = pygame.event.get()
+        else:
+            # sleep in SDL until input arrives or the deadline is due
+            timeout = self.idle_timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - pygame.time.get_ticks())
+            if timeout > 0:
+                event = pygame.event.wait(timeout)
+                events = [] if event.type == pygame.NOEVENT else [event]
+                events.extend(pygame.event.get())
+            else:
+                events = pygame.event.get()
+            self.dt = self.clock.tick()
+        self.time = pygame.time.get_ticks()
+        return events
+
+
+class SessionLog():
+    # binary session log: a header with the seed and rules, then every
+    # frame's time, dt and input events, then the final stats as json
+    header = struct.Struct('<4sBQHdHH')
+    frame = struct.Struct('<IIH')
+    event = struct.Struct('<BhhI')
+    magic = b'ARTR'
+    version = 2
+    end = 0xFFFFFFFF
+    event_types = [pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN,
+                   pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION, pygame.MOUSEWHEEL,
+                   pygame.VIDEORESIZE, pygame.VIDEOEXPOSE]
+
+    def encode(self, event):
+        code = self.event_types.index(event.type)
+        if event.type == pygame.KEYDOWN:
+            return self.event.pack(code, 0, 0, event.key)
+        if event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP):
+            return self.event.pack(code, *event.pos, event.button)
+        if event.type == pygame.MOUSEMOTION:
+            return self.event.pack(code, *event.pos, 0)
+        if event.type == pygame.MOUSEWHEEL:
+            return self.event.pack(code, event.x, event.y, 0)
+        return self.event.pack(code, 0, 0, 0)
+
+    def decode(self, data, offset):
+        code, x, y, value = self.event.unpack_from(data, offset)
+        event_type = self.event_types[code]
+        if event_type == pygame.KEYDOWN:
+            return pygame.event.Event(event_type, key=value, mod=0)
+        if event_type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP):
+            return pygame.event.Event(event_type, pos=(x, y), button=value)
+        if event_type == pygame.MOUSEMOTION:
+            return pygame.event.Event(event_type, pos=(x, y), rel=(0, 0),
+                                      buttons=(0, 0, 0))
+        if event_type == pygame.MOUSEWHEEL:
+            return pygame.event.Event(event_type, x=x, y=y, flipped=False)
+        return pygame.event.Event(event_type)
+
+
+class SessionRecorder(SessionLog):
+    def __init__(self, path, seed, parameters):
+        self.file = open(path, 'wb')
+        self.file.write(self.header.pack(
+            self.magic, self.version, seed, parameters['lives'],
+            parameters['threshold'], *parameters.get('resolution', (1024, 768))))
+
+    def record(self, time, dt, events):
+        events = [event for event in events if event.type in self.event_types]
+        self.file.write(self.frame.pack(time, dt, len(events)) +
+                        b''.join(self.encode(event) for event in events))
+        # a killed session keeps everything up to its last frame
+        self.file.flush()
+
+    def close(self, rows):
+        stats = json.dumps(rows).encode()
+        self.file.write(self.frame.pack(self.end, 0, 0) +
+                        struct.pack('<I', len(stats)) + stats)
+        self.file.close()
+
+
+class SessionReader(SessionLog):
+    def __init__(self, path):
+        self.data = Path(path).read_bytes()
+        if len(self.data) < self.header.size:
+            raise ValueError(f"{path} is not a version {self.version} session log")
+        magic, version, seed, lives, threshold, width, height = \
+            self.header.unpack_from(self.data)
+        if magic != self.magic or version != self.version:
+            raise ValueError(f"{path} is not a version {self.version} session log")
+        self.parameters = {'seed': seed, 'lives': lives, 'threshold': threshold,
+                           'resolution': (width, height)}
+        self.expected = None
+        self.frames = []
+        # a log cut short by a crash replays up to its last whole frame
+        offset = self.header.size
+        while offset + self.frame.size <= len(self.data):
+            time, dt, count = self.frame.unpack_from(self.data, offset)
+            offset += self.frame.size
+            if time == self.end:
+                if offset + 4 <= len(self.data):
+                    size, = struct.unpack_from('<I', self.data, offset)
+                    stats = self.data[offset + 4:offset + 4 + size]
+                    if len(stats) == size:
+                        self.expected = json.loads(stats)
+                break
+            if offset + count * self.event.size > len(self.data):
+                break
+            self.frames.append((time, dt, offset, count))
+            offset += count * self.event.size
+
+    def events(self, offset, count):
+        return [self.decode(self.data, offset + i * self.event.size)
+                for i in range(count)]
+
+
+class RecordingScheduler(Scheduler):
+    def __init__(self, recorder, fps=60):
+        super().__init__(fps)
+        self.recorder = recorder
+
+    def next_events(self, animating=False, deadline=None):
+        events = super().next_events(animating, deadline)
+        self.recorder.record(self.time, self.dt, events)
+        return events
+
+
+class ReplayScheduler(Scheduler):
+    # frames come from a session log, as fast as possible or at the
+    # recorded pace; live input is dropped
+    def __init__(self, reader, realtime=False):
+        super().__init__()
+        self.reader = reader
+        self.frames = iter(reader.frames)
+        self.realtime = realtime
+        self.offset = None
+
+    def next_events(self, animating=False, deadline=None):
+        pygame.event.get()
+        try:
+            self.time, self.dt, offset, count = next(self.frames)
+        except StopIteration:
+            return [pygame.event.Event(pygame.QUIT)]
+        events = self.reader.events(offset, count)
+        if self.realtime:
+            if self.offset is None:
+                self.offset = pygame.time.get_ticks() - self.time
+            pygame.time.wait(max(0, self.time + self.offset - pygame.time.get_ticks()))
+        return events
 
 
 class Game():
     def __init__(self, parameters):
+        pygame.init()
+        self.replay = None
+        self.recorder = None
+        if parameters.get('replay'):
+            # the seed and rules come from the log
+            self.replay = SessionReader(parameters['replay'])
+            parameters = {**parameters, **self.replay.parameters}
         self.parameters = parameters
+        self.seed = self.parameters.get('seed')
+        if self.seed is None:
+            self.seed = Random().getrandbits(63)
+        self.rng = Random(self.seed)
+        # sprites get their own generator so they do not shift the game's
+        self.sprite_rng = Random(f"sprites {self.seed}")
         self.levels = []
-        self.current_level = 0
         self.load_levels()
-        self.lives = self.parameters['lives']
-        self.accuracy = 0
-        self.speed = 0
-        self.screen_width = 1024
-        self.screen_height = 768
+        self.state = GameState([level.colors for level in self.levels],
+                               self.parameters['lives'],
+                               self.parameters['threshold'], self.rng)
+        # logical resolution, SDL scales it to whatever the window size is
+        self.screen_width, self.screen_height = self.parameters.get(
+            'resolution', (1024, 768))
+        # the layout was made for 1024x768, offsets and text follow the size
+        self.scale = min(self.screen_width / 1024, self.screen_height / 768)
         self.running = False
-        self.current_color = 0
-        self.scrolling_direction = -1
-        self.hearts = [Heart(self.screen_width - 100 + 30*i, 10)
-                       for i in range(self.lives)]
-        self.floating = []
+        self.hearts = []
+        self.floating = Swarm()
         self.assets = {}
         self.message_buffer = []
         self.elements = {}
-        self.sounds = {}
-        self.stats = pd.DataFrame(
-            columns=['level', 'accuracy', 'speed', 'level_order'])
+        self.dirty = []
+        self.full_redraw = True
+        self.audio = AudioBank()
+        self.asset_manager = AssetManager(self.audio)
+        if self.replay:
+            self.scheduler = ReplayScheduler(self.replay,
+                                             self.parameters.get('realtime', False))
+        elif self.parameters.get('record'):
+            self.recorder = SessionRecorder(self.parameters['record'], self.seed,
+                                            self.parameters)
+            self.scheduler = RecordingScheduler(self.recorder,
+                                                self.parameters.get('fps', 60))
+        else:
+            self.scheduler = Scheduler(self.parameters.get('fps', 60))
+        self.text = TextCache()
+        self.timeline = Timeline()
+        self.worker = Worker()
+        self.stats = StatsRecorder()
+        self.started = datetime.now().isoformat(timespec='seconds')
 
     def load_assets(self):
-        blue_screen = pygame.image.load('assets/Windows_NT_3.51_BSOD_ita.png')
-        self.assets['blue_screen'] = pygame.transform.scale(
-            blue_screen, (self.screen_width, self.screen_height))
-        self.assets['noise'] = []
-        for i in range(1, 61):
-            noise_image = pygame.image.load(
-                f"assets/noise/noise000{str(i).zfill(2)}.png")
-            self.assets['noise'].append(pygame.transform.scale(
-                noise_image, (self.screen_width, self.screen_height)))
-        external_link = pygame.image.load('assets/external_link.png')
-        self.assets['external_link'] = pygame.transform.scale(
-            external_link, (20, 20))
-        self.sounds['beep'] = pygame.mixer.Sound('effects/SqrSinBleepF.wav')
-        self.sounds['noise'] = pygame.mixer.Sound('effects/Radio_Static.mp3')
+        # runs in the background while the intro screen is shown
+        screen_size = (self.screen_width, self.screen_height)
+        self.asset_manager.add_image(
+            'blue_screen', 'assets/Windows_NT_3.51_BSOD_ita.png', screen_size)
+        self.asset_manager.add_image(
+            'external_link', 'assets/external_link.png', (20, 20), alpha=True)
+        self.asset_manager.add_sound('beep', 'effects/SqrSinBleepF.wav', 1)
+        self.asset_manager.add_sound('noise', 'effects/Radio_Static.mp3', 1)
+        self.asset_manager.start()
+        self.noise = Noise(screen_size)
+
+    def finish_loading_assets(self):
+        self.assets.update(self.asset_manager.result())
 
     def load_levels(self):
         logging.debug('Loading levels')
-        levels = list(Path('levels').glob('*.yml'))
-        for level in sample(levels, len(levels)):
+        levels = compile_manifest()
+        for level in self.rng.sample(levels, len(levels)):
             self.levels.append(Level(level))
-            logging.debug(f"Loaded level {level}")
+            logging.debug(f"Loaded level {level['title']}")
 
     def setup_current_level(self):
-        logging.debug(f"Setting up level {self.current_level}")
-        self.level = self.levels[self.current_level]
+        logging.debug(f"Setting up level {self.state.level}")
+        self.level = self.levels[self.state.level]
         logging.debug(f"with colors {self.level.colors}")
-        self.blocks = []
-        for background in self.level.colors:
-            color_axis = randint(0, 2)
-            foreground = list(background).copy()
-            foreground[color_axis] = background[color_axis] + \
-                20 * choice([-1, 1])
-            self.blocks.append(Block(foreground, 100, 100,
-                                     (self.screen_width-100)/2,
-                                     (self.screen_height-100)/2, color_axis))
+        # load artwork in the background while the palette is played
+        screen_size = (self.screen_width, self.screen_height)
+        self.level.prefetch(screen_size)
+        if self.state.level + 1 < len(self.levels):
+            self.levels[self.state.level + 1].prefetch(screen_size)
+        size = round(100 * self.scale)
+        self.blocks = [Block(size, size, (self.screen_width-size)/2,
+                             (self.screen_height-size)/2)
+                       for _ in self.level.colors]
+        self.invalidate()
 
+    @profiled('draw_lives')
     def draw_lives(self):
-        logging.debug('drawing lives')
         for heart in self.hearts:
             heart.draw(self.screen)
-        if self.floating:
-            for floating_heart in self.floating:
-                floating_heart.draw(self.screen)
+        self.screen.blits([(heart.image, heart.rect) for heart in self.floating],
+                          doreturn=False)
 
+    @profiled('draw_level')
     def draw_level(self):
-        logging.debug('Drawing level')
-        self.background = list(self.level.colors[self.current_color])
+        self.background = self.state.target()
         self.screen.fill(self.background)
-        self.blocks[self.current_color].draw(self.screen)
+        self.blocks[self.state.color].draw(self.screen, self.state.foreground())
         self.draw_title()
 
+    @profiled('draw_title')
     def draw_title(self):
-        logging.debug('Drawing title')
-        self.elements['title'] = self.font.render(
-            f"    {self.level.title} ", True, (200, 200, 200), (33, 33, 33))
+        self.elements['title'] = self.text.render(
+            self.font, f"    {self.level.title} ", True, (200, 200, 200), (33, 33, 33))
         self.screen.blit(self.elements['title'], (5, 5))
         self.screen.blit(self.assets['external_link'], (5, 5))
         self.draw_tutorial()
 
+    @profiled('draw_tutorial')
     def draw_tutorial(self):  # first time user experience
-        logging.debug('Drawing tutorial')
-        if self.current_level == 0:
+        if self.state.level == 0:
             if self.tutorial == 0:
-                message = self.font.render(
-                  ' Use the mouse or arrow keys to change the color of the central square. ',
+                message = self.text.render(
+                  self.font, ' Use the mouse or arrow keys to change the color of the central square. ',
                   True, (33, 33, 33), (232, 234, 246)
                 )
-                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2-100))
+                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2-100*self.scale))
             elif self.tutorial == 1:
-                message = self.font.render(
-                  ' Well done!!! Keep going ...',
+                message = self.text.render(
+                  self.font, ' Well done!!! Keep going ...',
                   True, (33, 33, 33), (232, 234, 246)
                 )
-                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+100))
-                message = self.font.render(
-                  ' When the square color matches the background ',
+                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+100*self.scale))
+                message = self.text.render(
+                  self.font, ' When the square color matches the background ',
                   True, (33, 33, 33), (232, 234, 246)
                 )
-                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+230))
-                message = self.font.render(
-                  ' [Left-click] or press [Enter] or [spacebar] to advance. ',
+                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+230*self.scale))
+                message = self.text.render(
+                  self.font, ' [Left-click] or press [Enter] or [spacebar] to advance. ',
                   True, (33, 33, 33), (232, 234, 246)
                 )
-                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+260))
+                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+260*self.scale))
             elif self.tutorial == 2:
-                message = self.font.render(
-                    ' Oops! If the colors do not match you will lose a life! ',
+                message = self.text.render(
+                    self.font, ' Oops! If the colors do not match you will lose a life! ',
                     True, (33, 33, 33), (232, 234, 246)
                 )
-                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+100))
+                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+100*self.scale))
             elif self.tutorial == 3:
-                message = self.font.render(
-                    ' Well done! continue with the following palette colors ... ',
+                message = self.text.render(
+                    self.font, ' Well done! continue with the following palette colors ... ',
                     True, (33, 33, 33), (232, 234, 246)
                 )
-                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2-100))
+                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2-100*self.scale))
             elif self.tutorial == 4:
-                message = self.font.render(
-                    ' Doing well! Keep going to reach the end of the level ! ',
+                message = self.text.render(
+                    self.font, ' Doing well! Keep going to reach the end of the level ! ',
                     True, (33, 33, 33), (232, 234, 246)
                 )
-                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2-100))
+                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2-100*self.scale))
             elif self.tutorial == 5:
-                message = self.font.render(
-                  ' Well done! First level complete! ',
+                message = self.text.render(
+                  self.font, ' Well done! First level complete! ',
                   True, (33, 33, 33), (232, 234, 246)
                 )
-                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+200))
-                message = self.fontbold.render(
-                  ' Warning! Next level will be harder! ',
+                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+200*self.scale))
+                message = self.text.render(
+                  self.fontbold, ' Warning! Next level will be harder! ',
                   True, (33, 33, 33), (232, 234, 246)
                 )
-                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+230))
-                message = self.font.render(
-                  ' Bugs in the source code will cause glitches. ',
+                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+230*self.scale))
+                message = self.text.render(
+                  self.font, ' Bugs in the source code will cause glitches. ',
                   True, (33, 33, 33), (232, 234, 246)
                 )
-                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+260))
-                message = self.font.render(
-                  ' Read the log messages to see how to deal with them, Good luck ! ',
+                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+260*self.scale))
+                message = self.text.render(
+                  self.font, ' Read the log messages to see how to deal with them, Good luck ! ',
                   True, (33, 33, 33), (232, 234, 246)
                 )
-                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+290))
+                self.screen.blit(message, (self.screen_width/2 - message.get_width()/2, self.screen_height/2 - message.get_height()/2+290*self.scale))
 
-    def end_level(self):
+    @profiled('end_level')
+    def end_level(self, accuracy, speed):
         logging.debug('End of level')
         self.screen.fill("#ECEEEA")
-        self.screen.blit(self.level.image,
-                         ((self.screen_width - self.level.width)/2,
-                          (self.screen_height - self.level.height)/2))
+        artwork = self.level.artwork((self.screen_width, self.screen_height))
+        self.screen.blit(artwork, artwork.get_rect(
+            center=(self.screen_width/2, self.screen_height/2)))
+        # the palette stacked up the left edge, smaller if it does not fit
+        size = min(round(100 * self.scale), self.screen_height // len(self.blocks))
         for i, block in enumerate(self.blocks):
-            block.move(0, self.screen_height - (i+1)*100)
-            block.draw(self.screen)
+            block.rect.size = (size, size)
+            block.move(0, self.screen_height - (i+1)*size)
+            block.draw(self.screen, self.state.foregrounds[i])
         self.draw_lives()
         self.draw_title()
-        accuracy = abs(self.accuracy/len(self.blocks))
-        accuracy = round(100 * (self.parameters['threshold'] - accuracy) / self.parameters['threshold'], 2)
-        self.accuracy = 0
-        speed = round((self.speed/1000)/len(self.blocks), 2)
-        self.stats = self.stats.append({'level': self.level.title,
-                                        'accuracy': accuracy,
-                                        'speed': speed,
-                                        'level_order': self.current_level}, ignore_index=True)
+        self.stats.record(self.level.title, accuracy, speed, self.state.level)
         level_accuracy = self.font.render(
             f" accuracy: {accuracy:.0f}% ", True, (200, 200, 200), (33, 33, 33))
         level_speed = self.font.render(
@@ -293,8 +1216,9 @@ class Game():
         self.screen.blit(level_speed, (0, 65))
         pygame.display.flip()
         self.wait_for_click()
-        self.next_level()
+        self.apply(self.state.step(('advance',)))
 
+    @profiled('game_over')
     def game_over(self, win):
         logging.debug('Game over')
         self.screen.fill((33, 33, 33))
@@ -303,62 +1227,123 @@ class Game():
         else:
             game_over = self.fontbold.render("Game Over", True, (250, 200, 200))
         self.screen.blit(game_over, game_over.get_rect(
-            center=(self.screen_width/2, 150)))
-        if self.stats.shape[0] > 0:
-            dfi.export(self.stats[['level', 'accuracy', 'speed']], 'game_stats.png')
-            stats_image = pygame.image.load('game_stats.png')
+            center=(self.screen_width/2, 150 * self.scale)))
+        if len(self.stats) > 0:
+            stats_image = self.render_table(
+                ['level', 'accuracy', 'speed'],
+                [row[:3] for row in self.stats.rows()],
+                max_width=self.screen_width - 40)
             table_rect = stats_image.get_rect(center=(self.screen_width/2, self.screen_height/2))
             self.screen.blit(stats_image, table_rect)
         pygame.display.flip()
         self.wait_for_click()
         self.end()
 
+    def render_table(self, header, rows, padding=10, max_width=None):
+        numeric = [not isinstance(value, str) for value in rows[0]]
+        rows = [[value if isinstance(value, str) else f"{value:.2f}"
+                 for value in row] for row in rows]
+        if max_width:
+            # long level names are cut short so the numbers stay on screen
+            text = [i for i in range(len(header)) if not numeric[i]]
+            fixed = sum(max(self.fontbold.size(str(header[i]))[0],
+                            *(self.font.size(row[i])[0] for row in rows))
+                        + 2 * padding for i in range(len(header)) if numeric[i])
+            room = ((max_width - fixed) // len(text) - 2 * padding) if text else 0
+            rows = [[self.ellipsize(value, room) if i in text else value
+                     for i, value in enumerate(row)] for row in rows]
+        cells = [[self.fontbold.render(str(name), True, (33, 33, 33))
+                  for name in header]]
+        for row in rows:
+            cells.append([self.font.render(value, True, (33, 33, 33))
+                          for value in row])
+        widths = [max(row[i].get_width() for row in cells) + 2 * padding
+                  for i in range(len(header))]
+        height = self.font.get_linesize() + padding
+        table = pygame.Surface((sum(widths), height * len(cells)))
+        table.fill((255, 255, 255))
+        for j, row in enumerate(cells):
+            if j % 2 == 1:
+                table.fill((245, 245, 245), (0, j * height, table.get_width(), height))
+            x = 0
+            for i, cell in enumerate(row):
+                # text columns left aligned, number columns right aligned
+                if numeric[i]:
+                    position = cell.get_rect(midright=(x + widths[i] - padding, (j + 0.5) * height))
+                else:
+                    position = cell.get_rect(midleft=(x + padding, (j + 0.5) * height))
+                table.blit(cell, position)
+                x += widths[i]
+        pygame.draw.line(table, (33, 33, 33), (0, height - 1), (table.get_width(), height - 1))
+        return table
+
+    def ellipsize(self, text, width):
+        if self.font.size(text)[0] <= width:
+            return text
+        while len(text) > 1 and self.font.size(text + '…')[0] > width:
+            text = text[:-1]
+        return text.rstrip() + '…'
+
     def next_level(self):
         logging.debug('Next level')
-        self.last_bug = time.time()
-        self.current_color = 0
-        self.current_level += 1
+        self.level.unload()
         self.message_buffer = []
-        if self.current_level == len(self.levels):
-            self.game_over(True)
-            return
         self.setup_current_level()
-        self.draw()
-
-    def next_color(self):
-        logging.debug('Next color')
-        self.current_color += 1
-        if self.current_color == len(self.blocks):
-            if self.tutorial == 4:
-                self.tutorial = 5
-            self.end_level()
-            return
-        self.draw()
 
+    @profiled('draw_messagebox')
     def draw_messagebox(self):
-        logging.debug('Drawing messagebox')
         for i, message in enumerate(self.message_buffer[-3:]):
-            line = self.font.render(
-                message, True, (200, 200, 200), (33, 33, 33))
+            line = self.text.render(
+                self.font, message, True, (200, 200, 200), (33, 33, 33))
             self.screen.blit(line, line.get_rect(
                 topleft=(30, self.screen_height - 100 + i*20)))
-        pygame.display.flip()
 
-    def draw(self):
-        logging.debug('Drawing')
+    def invalidate(self, rect=None):
+        # no rect means the whole screen changed (level, background, overlay)
+        if rect is None:
+            self.full_redraw = True
+        else:
+            self.dirty.append(pygame.Rect(rect))
+
+    def draw_scene(self):
         self.draw_level()
         self.draw_lives()
         self.draw_messagebox()
-        pygame.display.flip()
+
+    @profiled('draw')
+    def draw(self):
+        overlay = self.timeline.active()
+        if self.full_redraw or overlay:
+            self.screen.set_clip(None)
+            self.draw_scene()
+            self.timeline.draw(self.screen)
+            pygame.display.flip()
+        elif self.dirty:
+            if len(self.dirty) > 8:
+                # many small regions cost more as separate passes than one
+                self.dirty = [self.dirty[0].unionall(self.dirty[1:])]
+            # repaint the scene clipped to each changed region only
+            for rect in self.dirty:
+                self.screen.set_clip(rect)
+                self.draw_scene()
+            self.screen.set_clip(None)
+            pygame.display.update(self.dirty)
+        # the frame after an effect ends repaints everything it covered
+        self.full_redraw = overlay
+        self.dirty = []
 
     def setup_game(self):
         logging.debug('Setting up game')
-        self.font = pygame.font.Font("fonts/FiraCode-Regular.ttf", 20)
-        self.fontbold = pygame.font.Font("fonts/FiraCode-Bold.ttf", 20)
+        font_size = max(12, round(20 * self.scale))
+        self.font = pygame.font.Font("fonts/FiraCode-Regular.ttf", font_size)
+        self.fontbold = pygame.font.Font("fonts/FiraCode-Bold.ttf", font_size)
         self.tutorial = 0
         self.screen = pygame.display.set_mode(
-            (self.screen_width, self.screen_height))
+            (self.screen_width, self.screen_height),
+            pygame.SCALED | pygame.RESIZABLE)
         pygame.display.set_caption('Art')
+        self.hearts = [Heart(self.screen_width - 100 + 30*i, 10, self.sprite_rng)
+                       for i in range(self.state.lives)]
         self.screen.fill((33, 33, 33))
         self.running = True
         usage_list = [
@@ -379,18 +1364,22 @@ class Game():
         for i, text in enumerate(usage_list):
             line = self.font.render(text, True, (200, 200, 200), (33, 33, 33))
             self.screen.blit(line, line.get_rect(
-                center=(self.screen_width/2, 50 + i * 40)))
+                center=(self.screen_width/2, (50 + i * 40) * self.scale)))
         pygame.display.flip()
         self.load_assets()
-        self.clock = pygame.time.Clock()
         self.wait_for_click()
+        self.finish_loading_assets()
         self.setup_current_level()
         self.draw()
 
     def wait_for_click(self):
         waiting = True
         while(waiting):
-            for event in pygame.event.get():
+            # keep a streamed clip fed while the screen waits
+            self.audio.update()
+            for event in self.scheduler.next_events(self.audio.streaming()):
+                if event.type in (pygame.VIDEORESIZE, pygame.VIDEOEXPOSE):
+                    pygame.display.flip()
                 if self.check_quit(event):
                     self.end()
                 if self.advance(event):
@@ -403,130 +1392,177 @@ class Game():
             if event.key == pygame.K_ESCAPE:
                 return True
         elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            if 'external_link' not in self.assets:
+                return False
+            if self.replay:
+                return False
             if (self.assets['external_link'].get_rect().collidepoint(event.pos) or
                     ('title' in self.elements and self.elements['title'].get_rect().collidepoint(event.pos))):
-                webbrowser.open(self.level.url, new=0)
+                self.worker.submit('open link', webbrowser.open,
+                                   self.level.url, 0)
         return False
 
-    def bug(self):
+    def bug(self, bug_screen):
         logging.debug('Bug')
-        # flash noise
-        bug_screen = randint(0, 1)
-        back = self.screen.copy()
+        # flash noise, GameState applies the bug itself when it is over
         if bug_screen == 0:
-            self.screen.blit(self.assets['blue_screen'], (0, 0))
-            pygame.display.flip()
-            pygame.mixer.Sound.play(self.sounds['beep'])
-            time.sleep(0.5)
+            effect = Overlay(self.assets['blue_screen'], GLITCH_TIME)
+            self.audio.play('beep')
         elif bug_screen == 1:
-            r = randint(0, 50)
-            pygame.mixer.Sound.play(self.sounds['noise'])
-            for i in range(r, r+10):
-                logging.debug(i)
-                self.screen.blit(self.assets['noise'][i], (0, 0))
-                pygame.display.flip()
-                self.clock.tick(20)
-        # back to normal
-        self.screen.blit(back, (0, 0))
-        bug_type = randint(0, 3)
+            effect = Static(self.noise, GLITCH_TIME)
+            self.audio.play('noise')
+        self.timeline.add(effect, self.scheduler.now())
+        self.invalidate()
+
+    def apply_bug(self, bug_type):
         if bug_type == 0:
             # jump color
             message = "Overflow in srgb random shift of color."
-            self.blocks[self.current_color].change_color(choice((-1, 1)) * 100)
+            self.invalidate(self.blocks[self.state.color].rect)
         elif bug_type == 1:  # grey scale
             message = "Ink is running low."
-            self.blocks[self.current_color].greyscale()
-            self.level.colors[self.current_color] = rgb_to_greyscale(
-                self.level.colors[self.current_color])
+            self.invalidate()
         elif bug_type == 2:
             # - invert direction
             message = "I/O error controls inverted"
-            self.scrolling_direction = -self.scrolling_direction
         elif bug_type == 3:  # heart attack
             message = "Kernel panic, heart attack. Hover over heart to heal."
             if self.hearts:
-                self.floating.append(self.hearts.pop())
-                self.floating[-1].break_heart()
-                self.lives -= 1
-            else:
-                self.game_over(False)
-            self.draw_lives()
+                self.hearts[-1].break_heart()
+                self.invalidate(self.hearts[-1].rect)
+                self.floating.add(self.hearts.pop())
+        self.log_message(message)
+
+    def log_message(self, message):
         time_string = datetime.now().strftime('%b %d %H:%M:%S')
         self.message_buffer.append(f"{time_string} root - 0.0 {message}")
-        self.draw()
+        self.invalidate()
+
+    def animating(self):
+        # streams need the loop awake to queue their next chunk
+        return (bool(self.floating) or self.timeline.active() or
+                self.audio.streaming())
 
     def run(self):
         logging.debug('Run game')
-        bug_activated = False         # no bugs during in first level
         while(self.running):
-            if self.floating:
-                for floating_heart in self.floating:
-                    floating_heart.move(
-                        self.screen_width, self.screen_height)
-                self.draw()
-            if self.current_level > 0:
-                if bug_activated:
-                    if time.time() > r:
-                        bug_activated = False
-                        self.bug()
-                else:
-                    # pick when to activate bug
-                    r = random() * 10 + time.time()
-                    bug_activated = True
-            for event in pygame.event.get():
-                if self.check_quit(event):
-                    self.running = False
-                    self.end()
-                if self.advance(event):
-                    score = maxdiff(self.blocks[self.current_color].foreground,
-                                    self.background)
-                    if score < self.parameters['threshold']:
-                        self.accuracy += score
-                        self.speed += self.clock.get_time()
-                        self.clock.tick()
-                        if self.tutorial in [1, 2]:
-                            self.tutorial = 3
-                        elif self.tutorial == 3:
-                            self.tutorial = 4
-                        self.next_color()
-                    else:
-                        if self.tutorial == 1:
-                            self.tutorial = 2
-                        self.lives -= 1
-                        if self.lives == 0:
-                            self.game_over(False)
-                        self.hearts.pop()
-                        self.draw()
-                elif event.type == pygame.MOUSEWHEEL:
-                    if event.y == self.scrolling_direction * -1:
-                        self.blocks[self.current_color].change_color(1)
-                    if event.y == self.scrolling_direction * 1:
-                        self.blocks[self.current_color].change_color(-1)
-                    if self.tutorial == 0:
-                        self.tutorial = 1
-                    self.draw()
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_UP:
-                        self.blocks[self.current_color].change_color(self.scrolling_direction)
-                        if self.tutorial == 0:
-                            self.tutorial = 1
-                        self.draw()
-                    if event.key == pygame.K_DOWN:
-                        self.blocks[self.current_color].change_color(self.scrolling_direction * -1)
-                        if self.tutorial == 0:
-                            self.tutorial = 1
-                        self.draw()
-                elif event.type == pygame.MOUSEMOTION:
-                    for floating_heart in self.floating:
-                        if floating_heart.rect.collidepoint(event.pos):
-                            self.hearts.append(floating_heart)
-                            self.hearts[-1].move_to(self.screen_width -
-                                                    100 + 30 * (self.lives-1), 10)
-                            self.hearts[-1].heal_heart()
-                            self.lives += 1
-                            self.floating.remove(floating_heart)
-                            self.draw()
-                            break
+            self.step()
+
+    @profiled('step')
+    def step(self):
+        events = self.scheduler.next_events(self.animating(),
+                                            self.state.next_due())
+        profiler.count('frames')
+        profiler.count('events', len(events))
+        profiler.report()
+        self.apply(self.state.step(('tick', self.scheduler.now())))
+        self.handle_events(events)
+        self.audio.update()
+        if self.floating:
+            # cap the step so a stalled frame does not teleport the hearts
+            for rect in self.floating.update(min(self.scheduler.dt, 100),
+                                             self.screen_width,
+                                             self.screen_height):
+                self.invalidate(rect)
+        if self.timeline.active():
+            self.timeline.update(self.scheduler.now())
+            self.invalidate()
+        self.draw()
+
+    def handle_events(self, events):
+        # wheel and arrow keys fold into one color step and only the last
+        # mouse position is hit tested; other events flush the pending step
+        # first so a click judges the color scrolled before it
+        step = 0
+        position = None
+        for event in events:
+            delta = self.color_step(event)
+            if delta:
+                step += delta
+                continue
+            if event.type == pygame.MOUSEMOTION:
+                position = event.pos
+                continue
+            if step:
+                self.change_color(step)
+                step = 0
+            if event.type in (pygame.VIDEORESIZE, pygame.VIDEOEXPOSE):
+                self.invalidate()
+            if event.type == JOB_DONE and event.error:
+                self.log_message(f"{event.name} failed: {event.error}")
+            if self.check_quit(event):
+                self.running = False
+                self.end()
+            if self.advance(event):
+                self.apply(self.state.step(('advance',)))
+        if step:
+            self.change_color(step)
+        if position:
+            self.heal(position)
+
+    def color_step(self, event):
+        # GameState applies the scrolling direction
+        if event.type == pygame.MOUSEWHEEL:
+            return -event.y
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_UP:
+                return 1
+            if event.key == pygame.K_DOWN:
+                return -1
+        return 0
+
+    def heal(self, position):
+        index = self.floating.hit(position)
+        if index is not None and self.state.step(('heal',)):
+            floating_heart = self.floating.remove(index)
+            self.invalidate(floating_heart.rect)
+            self.hearts.append(floating_heart)
+            self.hearts[-1].move_to(self.screen_width -
+                                    100 + 30 * (self.state.lives-1), 10)
+            self.hearts[-1].heal_heart()
+            self.invalidate(floating_heart.rect)
+
+    def change_color(self, step):
+        self.apply(self.state.step(('scroll', step)))
+
+    def apply(self, events):
+        # game state events turned into what the player sees and hears
+        for event in events:
+            kind = event[0]
+            if kind == 'color':
+                self.invalidate(self.blocks[self.state.color].rect)
+                if self.tutorial == 0:
+                    self.tutorial = 1
+                    self.invalidate()
+            elif kind == 'match':
+                logging.debug('Next color')
+                if self.tutorial in [1, 2]:
+                    self.tutorial = 3
+                elif self.tutorial == 3:
+                    self.tutorial = 4
+                self.invalidate()
+            elif kind == 'miss':
+                if self.tutorial == 1:
+                    self.tutorial = 2
+                    self.invalidate()
+                if self.hearts:
+                    heart = self.hearts.pop()
+                    heart.kill()
+                    self.invalidate(heart.rect)
+            elif kind == 'level_complete':
+                if self.tutorial == 4:
+                    self.tutorial = 5
+                self.end_level(*event[1:])
+            elif kind == 'level_start':
+                self.next_level()
+            elif kind == 'win':
+                self.game_over(True)
+            elif kind == 'game_over':
+                self.game_over(False)
+            elif kind == 'glitch':
+                self.bug(event[1])
+            elif kind == 'bug':
+                self.apply_bug(event[1])
 
     def advance(self, event):
         if event.type == pygame.MOUSEBUTTONUP and event.button == 1:
@@ -536,20 +1572,86 @@ class Game():
                 return True
         return False
 
+    def save_stats(self):
+        store = StatsStore(self.parameters['highscore'],
+                           Path(self.parameters['highscore']).with_suffix('.csv'))
+        store.save(self.parameters.get('player', getpass.getuser()),
+                   self.started, self.stats)
+        store.close()
+
+    def verify_replay(self):
+        # stats go through json in the log, compare them the same way
+        rows = json.loads(json.dumps(self.stats.rows()))
+        if self.replay.expected is None:
+            print('Replay log has no final stats to verify')
+            return True
+        if rows != self.replay.expected:
+            print(f"Replay stats differ\nrecorded: {self.replay.expected}\n"
+                  f"replayed: {rows}")
+            return False
+        print('Replay stats match')
+        return True
+
     def end(self):
-        self.stats.to_csv(self.parameters['highscore'],
-                          mode='a',
-                          index=False,
-                          header=(not Path(self.parameters['highscore']).exists()))
+        # the current and next level may still be loading their artwork
+        for level in self.levels:
+            level.unload()
+        if self.replay:
+            self.worker.shutdown()
+            pygame.quit()
+            exit(0 if self.verify_replay() else 1)
+        if self.recorder:
+            self.recorder.close(self.stats.rows())
+        if not self.worker.submit('save stats', self.save_stats):
+            self.save_stats()
+        self.worker.shutdown()
         pygame.quit()
         print('Game Over')
         exit(0)
 
 
 if __name__ == '__main__':
-    logging.basicConfig(filename='debug.log',
-                        level=logging.DEBUG, filemode='w')
-    parameters = {'lives': 3, 'threshold': 5, 'highscore': 'highscore.csv'}
+    parser = argparse.ArgumentParser(description='Color matching art game.')
+    parser.add_argument('--profile', action='store_true',
+                        help='log a summary of frame timings periodically')
+    parser.add_argument('--trace', help='write a Chrome trace json file at exit')
+    parser.add_argument('--resolution', default='1024x768',
+                        help='logical resolution, the window can be resized freely')
+    parser.add_argument('--seed', type=int, help='seed for levels and bugs')
+    parser.add_argument('--record', help='write a session log to replay later')
+    parser.add_argument('--replay', help='replay a session log and check its stats')
+    parser.add_argument('--realtime', action='store_true',
+                        help='replay at the recorded pace in a window')
+    parser.add_argument('--stats', action='store_true',
+                        help='print best scores and your history, then exit')
+    args = parser.parse_args()
+    if args.seed is not None and not 0 <= args.seed < 2**63:
+        parser.error('--seed must be between 0 and 2**63 - 1')
+    match = re.fullmatch(r'(\d+)x(\d+)', args.resolution)
+    if not match:
+        parser.error('--resolution must look like 1024x768')
+    resolution = tuple(int(size) for size in match.groups())
+    if resolution[0] < 640 or resolution[1] < 480:
+        parser.error('--resolution must be at least 640x480')
+    if args.stats:
+        store = StatsStore('highscore.db', 'highscore.csv')
+        print(store.summary(getpass.getuser()))
+        store.close()
+        exit(0)
+    if args.replay and not args.realtime:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    setup_logging()
+    if args.profile or args.trace:
+        profiler.enable(trace=bool(args.trace))
+        atexit.register(lambda: logging.info(f"profile\n{profiler.summary()}"))
+    if args.trace:
+        atexit.register(profiler.write_trace, args.trace)
+    parameters = {'lives': 3, 'threshold': 5, 'highscore': 'highscore.db',
+                  'fps': 60,
+                  'resolution': resolution,
+                  'seed': args.seed, 'record': args.record,
+                  'replay': args.replay, 'realtime': args.realtime}
     game = Game(parameters)
     game.setup_game()
     game.run()
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame  # noqa: E402
+
+import art  # noqa: E402
+
+CLICK = {'button': 1, 'pos': (512, 384)}
+
+
+class FixedClock():
+    # every frame advances animations by one 60 fps step without sleeping
+    def tick(self, framerate=0):
+        return 1000 // 60
+
+
+def post(event_type, **attributes):
+    pygame.event.post(pygame.event.Event(event_type, **attributes))
+
+
+def new_game(lives=3):
+    highscore = Path(tempfile.mkdtemp()) / 'highscore.db'
+    game = art.Game({'lives': lives, 'threshold': 5,
+                     'highscore': str(highscore), 'fps': 0})
+    post(pygame.MOUSEBUTTONUP, **CLICK)
+    game.setup_game()
+    return game
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    try:
+        function(*args)
+    except SystemExit:
+        pass
+    return time.perf_counter() - start
+
+
+def frame(game):
+    # keep the scheduler from idling when the script has no input this frame
+    post(pygame.USEREVENT)
+    return timed(game.step)
+
+
+def match_color(game):
+    game.state.foregrounds[game.state.color] = list(game.state.target())
+
+
+def startup(frames):
+    start = time.perf_counter()
+    new_game()
+    return {'startup': time.perf_counter() - start}
+
+
+def wheel(frames, burst=20):
+    game = new_game()
+    times = []
+    for i in range(frames):
+        for _ in range(burst):
+            post(pygame.MOUSEWHEEL, x=0, y=1 if i % 2 else -1, flipped=False)
+        times.append(timed(game.step))
+    return {'frames': times}
+
+
+def advance(frames):
+    game = new_game()
+    times = []
+    for i in range(frames):
+        if game.state.color == len(game.blocks) - 1:
+            # stay on the level, end_level has its own scenario
+            game.state.color = 0
+            game.invalidate()
+        match_color(game)
+        post(pygame.MOUSEBUTTONUP, **CLICK)
+        times.append(timed(game.step))
+    return {'frames': times}
+
+
+def bug(frames):
+    game = new_game(lives=10)
+    times = []
+    for i in range(frames):
+        times.append(timed(game.apply, game.state.trigger_bug()))
+        while game.timeline.active() or game.state.pending:
+            times.append(frame(game))
+        while game.floating:
+            game.heal(game.floating.sprites[0].rect.center)
+    return {'frames': times}
+
+
+def hearts(frames, count=200):
+    game = new_game(lives=count)
+    while game.hearts:
+        game.apply(game.state.bug(3))
+    game.scheduler.clock = FixedClock()
+    times = []
+    for i in range(frames):
+        if not game.floating:
+            break
+        if i % 50 == 49:
+            # chase a heart with the mouse
+            post(pygame.MOUSEMOTION, pos=game.floating.sprites[0].rect.center,
+                 rel=(0, 0), buttons=(0, 0, 0))
+        times.append(frame(game))
+    return {'frames': times}
+
+
+def end_level(frames):
+    game = new_game()
+    times = []
+    for i in range(min(frames, len(game.levels) - 1)):
+        # the click leaves the end screen for the next level
+        events = game.state.complete_level()
+        post(pygame.MOUSEBUTTONUP, **CLICK)
+        times.append(timed(game.apply, events))
+    return {'frames': times}
+
+
+def game_over(frames):
+    game = new_game()
+    for i in range(len(game.levels)):
+        game.stats.record(game.levels[i].title, 90.0, 1.5, i)
+    post(pygame.MOUSEBUTTONUP, **CLICK)
+    return {'frames': [timed(game.game_over, False)]}
+
+
+def replay(path):
+    # every frame of a recorded session, without its pauses
+    game = art.Game({'replay': path, 'highscore': None})
+    start = time.perf_counter()
+    game.setup_game()
+    times = [time.perf_counter() - start]
+    try:
+        while True:
+            start = time.perf_counter()
+            game.step()
+            times.append(time.perf_counter() - start)
+    except SystemExit:
+        pass
+    return {'frames': times}
+
+
+scenarios = {
+    'startup': (startup, 1),
+    'wheel': (wheel, 300),
+    'advance': (advance, 100),
+    'bug': (bug, 10),
+    'hearts': (hearts, 300),
+    'end_level': (end_level, 5),
+    'game_over': (game_over, 1),
+}
+
+
+def summarize(result):
+    summary = {}
+    if 'startup' in result:
+        summary['startup_ms'] = 1000 * result['startup']
+    if 'frames' in result:
+        frames = sorted(1000 * t for t in result['frames'])
+        total = sum(frames)
+        summary.update({
+            'frames': len(frames),
+            'mean_ms': total / len(frames),
+            'p50_ms': frames[len(frames) // 2],
+            'p95_ms': frames[int(0.95 * (len(frames) - 1))],
+            'p99_ms': frames[int(0.99 * (len(frames) - 1))],
+            'max_ms': frames[-1],
+            'fps': 1000 * len(frames) / total if total else float('inf'),
+        })
+    # ru_maxrss is in kilobytes on Linux
+    summary['peak_rss_mb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss / 1024
+    return summary
+
+
+def run_isolated(name, frames):
+    # one process per scenario so startup and peak memory are not shared
+    command = [sys.executable, __file__, '--scenario', name, '--json']
+    if frames:
+        command += ['--frames', str(frames)]
+    output = subprocess.run(command, check=True, capture_output=True,
+                            text=True, cwd=Path(__file__).parent).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def compare(results, baseline, tolerance, noise=0.5):
+    # differences under `noise` (ms or MB) are timer and allocator jitter
+    regressions = []
+    for name, summary in results.items():
+        for metric, value in summary.items():
+            if metric in ('frames', 'fps') or metric not in baseline.get(name, {}):
+                continue
+            reference = baseline[name][metric]
+            if value > reference * (1 + tolerance) and value - reference > noise:
+                regressions.append(
+                    f"{name} {metric}: {value:.2f} vs {reference:.2f} "
+                    f"(+{100 * (value / reference - 1):.0f}%)")
+    return regressions
+
+
+def report(results):
+    for name, summary in results.items():
+        print(name)
+        for metric, value in summary.items():
+            print(f"  {metric:>12}: {value:.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Headless rendering benchmarks for the art palette game.')
+    parser.add_argument('--scenario', action='append', choices=scenarios,
+                        help='scenario to run (default: all)')
+    parser.add_argument('--frames', type=int,
+                        help='frames per scenario instead of its default')
+    parser.add_argument('--save', help='write the results as a baseline')
+    parser.add_argument('--compare', help='baseline to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown against the baseline')
+    parser.add_argument('--json', action='store_true',
+                        help='print results of a single scenario as json')
+    parser.add_argument('--replay',
+                        help='time the frames of a recorded session instead')
+    args = parser.parse_args()
+    if args.replay:
+        args.replay = str(Path(args.replay).resolve())
+    os.chdir(Path(__file__).parent)
+    names = args.scenario or list(scenarios)
+    if args.json:
+        function, frames = scenarios[names[0]]
+        print(json.dumps(summarize(function(args.frames or frames))))
+        sys.exit(0)
+    if args.replay:
+        results = {'replay': summarize(replay(args.replay))}
+    else:
+        results = {name: run_isolated(name, args.frames) for name in names}
+    report(results)
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()),
+                              args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,57 @@
+import numpy as np
+
+# colors are uint8 arrays of shape (..., 3), everything here works on a
+# single color, a palette or millions of recorded attempts alike
+
+LUMA = np.array([0.299, 0.587, 0.114])
+# sRGB (D65) to XYZ with each row divided by the white point, so white is 1
+WHITE = np.array([0.95047, 1.0, 1.08883])
+RGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                       [0.2126729, 0.7151522, 0.0721750],
+                       [0.0193339, 0.1191920, 0.9503041]]) / WHITE[:, np.newaxis]
+F_STEPS = 4096
+
+
+def srgb_to_linear(values):
+    values = values / 255
+    return np.where(values <= 0.04045, values / 12.92,
+                    ((values + 0.055) / 1.055) ** 2.4)
+
+
+def lab_f(t):
+    return np.where(t > (6 / 29) ** 3, np.cbrt(t),
+                    t / (3 * (6 / 29) ** 2) + 4 / 29)
+
+
+# lookup tables: linear light per 8 bit value and the Lab curve over [0, 1]
+LINEAR = srgb_to_linear(np.arange(256))
+F_TABLE = lab_f(np.linspace(0, 1, F_STEPS + 1))
+
+
+def as_colors(colors):
+    return np.asarray(colors, dtype=np.uint8)
+
+
+def clamp(colors, low=0, high=254):
+    return np.clip(colors, low, high).astype(np.uint8)
+
+
+def greyscale(colors):
+    grey = np.rint(np.asarray(colors) @ LUMA).astype(np.uint8)
+    return np.repeat(grey[..., np.newaxis], 3, axis=-1)
+
+
+def to_lab(colors):
+    xyz = LINEAR[as_colors(colors)] @ RGB_TO_XYZ.T
+    # linear interpolation between the two nearest table entries
+    position = np.clip(xyz, 0, 1) * F_STEPS
+    index = np.minimum(position.astype(np.intp), F_STEPS - 1)
+    low = F_TABLE[index]
+    f = low + (position - index) * (F_TABLE[index + 1] - low)
+    fx, fy, fz = np.moveaxis(f, -1, 0)
+    return np.stack([116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)], axis=-1)
+
+
+def delta_e(a, b):
+    # CIE76 color difference, about 2.3 is just noticeable
+    return np.linalg.norm(to_lab(a) - to_lab(b), axis=-1)
@@ -0,0 +1,131 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np  # noqa: E402
+import pygame  # noqa: E402
+
+from colors import delta_e  # noqa: E402
+
+IMAGE_TYPES = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')
+
+
+def load_pixels(path, samples=128 * 128):
+    image = pygame.image.load(path)
+    pixels = pygame.surfarray.array3d(image)
+    # every stride-th pixel in both directions is plenty for a palette,
+    # fully transparent ones are not part of the artwork
+    stride = max(1, int(np.sqrt(pixels.shape[0] * pixels.shape[1] / samples)))
+    opaque = pygame.surfarray.array_alpha(image)[::stride, ::stride] > 0
+    pixels = pixels[::stride, ::stride][opaque].astype(np.float32)
+    if len(pixels) == 0:
+        raise ValueError(f"{path} has no opaque pixels")
+    return pixels
+
+
+def median_cut(pixels, colors):
+    boxes = [pixels]
+    while len(boxes) < colors:
+        ranges = [np.ptp(box, axis=0).max() if len(box) > 1 else -1
+                  for box in boxes]
+        widest = int(np.argmax(ranges))
+        if ranges[widest] <= 0:
+            break
+        box = boxes.pop(widest)
+        channel = np.argmax(np.ptp(box, axis=0))
+        box = box[np.argsort(box[:, channel])]
+        boxes += [box[:len(box) // 2], box[len(box) // 2:]]
+    return np.array([box.mean(axis=0) for box in boxes])
+
+
+def kmeans(pixels, centers, iterations=10):
+    for _ in range(iterations):
+        distances = ((pixels[:, np.newaxis] - centers) ** 2).sum(axis=2)
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=len(centers))
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, pixels)
+        moved = counts > 0
+        centers[moved] = sums[moved] / counts[moved, np.newaxis]
+    return centers, np.bincount(labels, minlength=len(centers))
+
+
+def distinct(centers, min_distance):
+    # drop colors closer than min_distance (ΔE) to a more common one
+    kept = []
+    for center in centers:
+        if not kept or delta_e(kept, center).min() >= min_distance:
+            kept.append(center)
+    return kept
+
+
+def extract(path, colors, min_distance=5):
+    # median cut seeds k-means, most common colors first
+    pixels = load_pixels(path)
+    centers, counts = kmeans(pixels, median_cut(pixels, colors))
+    centers = np.clip(np.rint(centers), 0, 255).astype(np.uint8)[np.argsort(-counts)]
+    return ['#{:02X}{:02X}{:02X}'.format(*center)
+            for center in distinct(centers, min_distance)]
+
+
+def content_hash(path):
+    return hashlib.sha1(Path(path).read_bytes()).hexdigest()
+
+
+def extract_all(images, colors, cache_file='.cache/palettes.json', workers=None,
+                min_distance=5):
+    cache_file = Path(cache_file)
+    cache = json.loads(cache_file.read_text()) if cache_file.exists() else {}
+    keys = {image: f"{content_hash(image)}:{colors}:{min_distance}:opaque"
+            for image in images}
+    missing = [image for image in images if keys[image] not in cache]
+    with ProcessPoolExecutor(workers) as pool:
+        for image, palette in zip(missing, pool.map(
+                extract, missing, [colors] * len(missing),
+                [min_distance] * len(missing))):
+            cache[keys[image]] = palette
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    cache_file.write_text(json.dumps(cache))
+    return {image: cache[keys[image]] for image in images}
+
+
+def write_level(path, image, palette, url=''):
+    title = Path(image).stem.replace('_', ' ').capitalize()
+    colors = ', '.join(f'"{color}"' for color in palette)
+    Path(path).write_text(f"title: {json.dumps(title)}\n"
+                          f"url: {json.dumps(url)}\n"
+                          f"image: {json.dumps(str(image))}\n"
+                          f"colors: [{colors}]\n")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate level files with palettes extracted from artwork.')
+    parser.add_argument('images', help='directory with artwork images')
+    parser.add_argument('--colors', type=int, default=4,
+                        help='colors per palette')
+    parser.add_argument('--output', default='levels',
+                        help='directory for the level files')
+    parser.add_argument('--min-distance', type=float, default=5,
+                        help='smallest ΔE between two colors of a palette')
+    parser.add_argument('--workers', type=int, help='worker processes')
+    parser.add_argument('--force', action='store_true',
+                        help='overwrite existing level files')
+    args = parser.parse_args()
+    images = sorted(str(path) for path in Path(args.images).iterdir()
+                    if path.suffix.lower() in IMAGE_TYPES)
+    palettes = extract_all(images, args.colors, workers=args.workers,
+                           min_distance=args.min_distance)
+    Path(args.output).mkdir(parents=True, exist_ok=True)
+    for image, palette in palettes.items():
+        level = Path(args.output) / f"{Path(image).stem}.yml"
+        if level.exists() and not args.force:
+            print(f"skipping {level}, it already exists")
+            continue
+        write_level(level, image, palette)
+        print(f"{level}: {' '.join(palette)}")
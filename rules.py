@@ -0,0 +1,181 @@
+import random
+
+import numpy as np
+
+from colors import clamp, delta_e, greyscale
+
+GLITCH_TIME = 500     # ms a glitch is on screen before its bug hits
+BUG_INTERVAL = 10000  # bugs hit at a random time within this many ms
+
+
+class GameState():
+    # the rules of the game without any pygame: step() takes an action and
+    # returns what happened as a list of event tuples; a color matches when
+    # its CIE76 distance from the target is under the threshold
+    #
+    # actions: ('tick', now_ms), ('scroll', amount), ('advance',), ('heal',)
+    # events: ('color',), ('match', score), ('miss',), ('level_complete',
+    # accuracy, speed), ('level_start',), ('win',), ('game_over',),
+    # ('glitch', screen), ('bug', bug_type), ('heal',)
+    def __init__(self, palettes, lives=3, threshold=5, rng=None):
+        self.rng = rng or random.Random()
+        self.palettes = palettes
+        self.lives = lives
+        self.threshold = threshold
+        self.floating = 0
+        self.level = 0
+        self.direction = -1
+        self.now = 0
+        self.phase = 'playing'
+        self.results = []
+        self.setup_level()
+
+    def setup_level(self):
+        self.color = 0
+        self.targets = np.array(self.palettes[self.level], dtype=np.uint8)
+        self.axes = []
+        self.foregrounds = self.targets.copy()
+        for target, foreground in zip(self.targets, self.foregrounds):
+            axis = self.rng.randint(0, 2)
+            sign = self.rng.choice([-1, 1])
+            # the shift grows, then turns around, until the color no longer
+            # matches already; a clamped or dark channel may need more than 20
+            for shift in [sign * amount for amount in range(20, 255, 20)] + \
+                         [-sign * amount for amount in range(20, 255, 20)]:
+                candidate = target.astype(np.int16)
+                candidate[axis] += shift
+                foreground[:] = clamp(candidate)
+                if delta_e(foreground, target) >= self.threshold:
+                    break
+            self.axes.append(axis)
+        self.greyscale = [False] * len(self.targets)
+        self.speed = 0
+        # timing starts with the first tick the level is played
+        self.color_started = None
+        self.bug_due = None
+        self.pending = []
+
+    def target(self):
+        return self.targets[self.color]
+
+    def foreground(self):
+        return self.foregrounds[self.color]
+
+    def next_due(self):
+        # the next time a tick would change anything, None if never
+        times = [due for due, _ in self.pending]
+        if self.bug_due is not None:
+            times.append(self.bug_due)
+        return min(times) if times else None
+
+    def step(self, action):
+        kind = action[0]
+        if kind == 'tick':
+            return self.tick(action[1])
+        if self.phase == 'over':
+            return []
+        if kind == 'scroll':
+            return self.scroll(action[1])
+        if kind == 'advance':
+            return self.advance()
+        if kind == 'heal':
+            return self.heal()
+        raise ValueError(f"Unknown action {kind}")
+
+    def tick(self, now):
+        self.now = now
+        if self.color_started is None and self.phase == 'playing':
+            self.color_started = now
+        if self.phase != 'playing':
+            return []
+        events = []
+        # no bugs during the first level
+        if self.level > 0 and self.bug_due is None:
+            self.bug_due = now + int(self.rng.random() * BUG_INTERVAL)
+        elif self.level > 0 and now >= self.bug_due:
+            self.bug_due = now + int(self.rng.random() * BUG_INTERVAL)
+            events += self.trigger_bug()
+        while self.pending and self.pending[0][0] <= now and self.phase == 'playing':
+            _, bug_type = self.pending.pop(0)
+            events += self.bug(bug_type)
+        return events
+
+    def trigger_bug(self):
+        screen = self.rng.randint(0, 1)
+        self.pending.append((self.now + GLITCH_TIME, self.rng.randint(0, 3)))
+        return [('glitch', screen)]
+
+    def change_color(self, step):
+        foreground = self.foreground().astype(np.int16)
+        if self.greyscale[self.color]:
+            foreground += step
+        else:
+            foreground[self.axes[self.color]] += step
+        self.foregrounds[self.color] = clamp(foreground)
+
+    def scroll(self, amount):
+        if self.phase != 'playing' or amount == 0:
+            return []
+        self.change_color(amount * self.direction)
+        return [('color',)]
+
+    def advance(self):
+        if self.phase == 'level_complete':
+            return self.next_level()
+        score = float(delta_e(self.foreground(), self.target()))
+        if score < self.threshold:
+            if self.color_started is not None:
+                self.speed += self.now - self.color_started
+            self.color_started = self.now
+            self.color += 1
+            if self.color == len(self.targets):
+                return [('match', score)] + self.complete_level()
+            return [('match', score)]
+        self.lives -= 1
+        if self.lives <= 0:
+            self.phase = 'over'
+            return [('miss',), ('game_over',)]
+        return [('miss',)]
+
+    def complete_level(self):
+        # every matched color stays as it was clicked, score them together
+        count = len(self.targets)
+        error = float(delta_e(self.foregrounds, self.targets).mean())
+        accuracy = round(100 * (self.threshold - error) / self.threshold, 2)
+        speed = round((self.speed / 1000) / count, 2)
+        self.results.append((self.level, accuracy, speed))
+        self.phase = 'level_complete'
+        return [('level_complete', accuracy, speed)]
+
+    def next_level(self):
+        self.level += 1
+        if self.level == len(self.palettes):
+            self.phase = 'over'
+            return [('win',)]
+        self.phase = 'playing'
+        self.setup_level()
+        return [('level_start',)]
+
+    def bug(self, bug_type):
+        if bug_type == 0:  # jump color
+            self.change_color(self.rng.choice((-1, 1)) * 100)
+        elif bug_type == 1:  # grey scale
+            self.foregrounds[self.color] = greyscale(self.foreground())
+            self.greyscale[self.color] = True
+            self.targets[self.color] = greyscale(self.target())
+        elif bug_type == 2:  # invert direction
+            self.direction = -self.direction
+        elif bug_type == 3:  # heart attack
+            if self.lives == 0:
+                self.phase = 'over'
+                return [('bug', bug_type), ('game_over',)]
+            self.lives -= 1
+            self.floating += 1
+        return [('bug', bug_type)]
+
+    def heal(self):
+        if self.floating == 0:
+            return []
+        self.floating -= 1
+        self.lives += 1
+        return [('heal',)]
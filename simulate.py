@@ -0,0 +1,204 @@
+import argparse
+import json
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from pathlib import Path
+from random import Random
+
+from webcolors import hex_to_rgb
+from yaml import SafeLoader, load
+
+from rules import GameState
+
+FRAME = 16                  # ms between bot decisions, one 60 fps frame
+SESSION_LIMIT = 30 * 60000  # sessions still running after this are timeouts
+
+
+def load_palettes(directory='levels'):
+    palettes = {}
+    for path in sorted(Path(directory).glob('*.yml')):
+        with open(path) as f:
+            data = load(f, Loader=SafeLoader)
+        palettes[data['title']] = [tuple(hex_to_rgb(color))
+                                   for color in data['colors']]
+    return palettes
+
+
+class Bot():
+    # a player that sees the colors exactly but stops scrolling a little off
+    # target, takes a while to click and sometimes chases a floating heart
+    def __init__(self, rng, aim=2.0, burst=5, reaction=400, heal_rate=0.5):
+        self.rng = rng
+        self.aim = aim
+        self.burst = burst
+        self.reaction = reaction
+        self.heal_rate = heal_rate
+        self.offset = None
+        self.ready = None
+
+    def act(self, state, now):
+        if state.phase == 'level_complete':
+            return self.wait(now, 4 * self.reaction, ('advance',))
+        if state.floating and self.rng.random() < self.heal_rate * FRAME / 1000:
+            return ('heal',)
+        if self.offset is None:
+            self.offset = round(self.rng.gauss(0, self.aim))
+        channel = 0 if state.greyscale[state.color] else state.axes[state.color]
+        wanted = min(max(int(state.target()[channel]) + self.offset, 0), 254)
+        error = wanted - int(state.foreground()[channel])
+        if error:
+            self.ready = None
+            step = max(-self.burst, min(self.burst, error))
+            return ('scroll', step * state.direction)
+        action = self.wait(now, self.reaction, ('advance',))
+        if action:
+            self.offset = None
+        return action
+
+    def wait(self, now, mean, action):
+        if self.ready is None:
+            self.ready = now + max(0, self.rng.gauss(mean, mean / 4))
+        if now < self.ready:
+            return None
+        self.ready = None
+        return action
+
+
+def play(palettes, lives, threshold, seed, bot_options):
+    # one session, the same level order and rules as Game with this seed
+    rng = Random(seed)
+    titles = rng.sample(list(palettes), len(palettes))
+    state = GameState([palettes[title] for title in titles], lives, threshold, rng)
+    bot = Bot(Random(f"bot {seed}"), **bot_options)
+    misses = Counter()
+    outcome = 'timeout'
+    now = 0
+    while now < SESSION_LIMIT:
+        now += FRAME
+        events = state.step(('tick', now))
+        action = bot.act(state, now) if state.phase != 'over' else None
+        if action:
+            events += state.step(action)
+        for event in events:
+            if event[0] == 'miss':
+                misses[titles[state.level]] += 1
+        if state.phase == 'over':
+            outcome = 'win' if state.level == len(titles) else 'loss'
+            break
+    played = titles[:state.level + 1] if outcome != 'win' else titles
+    return outcome, lives - state.lives, played, misses, [
+        (titles[level], accuracy) for level, accuracy, _ in state.results]
+
+
+def accuracy_bucket(accuracy):
+    # 10% wide buckets, everything below -100% in the last one
+    return min(max(int(accuracy // 10), -10), 10)
+
+
+def simulate(palettes, lives, threshold, seeds, bot_options):
+    summary = defaultdict(Counter)
+    for seed in seeds:
+        outcome, lives_lost, played, misses, results = play(
+            palettes, lives, threshold, seed, bot_options)
+        summary['outcome'][outcome] += 1
+        summary['lives_lost'][lives_lost] += 1
+        summary['played'].update(played)
+        summary['misses'].update(misses)
+        for title, accuracy in results:
+            summary['completed'][title] += 1
+            summary['accuracy'][(title, accuracy_bucket(accuracy))] += 1
+    return (lives, threshold), dict(summary)
+
+
+def run(palettes, lives, thresholds, sessions, workers=None, chunk=1000,
+        seed=0, bot_options={}):
+    # seed chunks of every configuration spread over a process pool, the
+    # workers send back counters instead of per session results
+    totals = defaultdict(lambda: defaultdict(Counter))
+    with ProcessPoolExecutor(workers) as pool:
+        jobs = [pool.submit(simulate, palettes, life_count, threshold,
+                            range(start, min(start + chunk, seed + sessions)),
+                            bot_options)
+                for life_count, threshold in product(lives, thresholds)
+                for start in range(seed, seed + sessions, chunk)]
+        for job in as_completed(jobs):
+            config, summary = job.result()
+            for name, counter in summary.items():
+                totals[config][name].update(counter)
+    return totals
+
+
+def percentile(histogram, fraction):
+    target = fraction * sum(histogram.values())
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= target:
+            return bucket
+    return None
+
+
+def report(palettes, totals):
+    for (lives, threshold), summary in sorted(totals.items()):
+        sessions = sum(summary['outcome'].values())
+        lost = summary['lives_lost']
+        print(f"lives {lives} threshold {threshold}: {sessions} sessions, "
+              f"win rate {100 * summary['outcome']['win'] / sessions:.1f}%, "
+              f"timeouts {summary['outcome']['timeout']}, lives lost mean "
+              f"{sum(k * v for k, v in lost.items()) / sessions:.2f} "
+              f"p90 {percentile(lost, 0.9)}")
+        print(f"  {'level':<34}{'played':>8}{'cleared':>9}{'misses':>8}"
+              f"{'acc p10':>9}{'acc p50':>9}{'acc p90':>9}")
+        for title in palettes:
+            played = summary['played'][title]
+            if not played:
+                continue
+            accuracy = {bucket: n for (name, bucket), n
+                        in summary['accuracy'].items() if name == title}
+            quantiles = [percentile(accuracy, fraction)
+                         for fraction in (0.1, 0.5, 0.9)]
+            quantiles = [f"{10 * q}%" if q is not None else '-'
+                         for q in quantiles]
+            print(f"  {title[:33]:<34}{played:>8}"
+                  f"{100 * summary['completed'][title] / played:>8.1f}%"
+                  f"{summary['misses'][title] / played:>8.2f}"
+                  + ''.join(f"{q:>9}" for q in quantiles))
+
+
+def to_json(totals):
+    return {f"lives={lives} threshold={threshold}": {
+                name: {str(key): value for key, value in counter.items()}
+                for name, counter in summary.items()}
+            for (lives, threshold), summary in sorted(totals.items())}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Play bot sessions headless to tune lives and threshold.')
+    parser.add_argument('--sessions', type=int, default=10000,
+                        help='sessions per lives and threshold pair')
+    parser.add_argument('--lives', type=int, nargs='+', default=[3])
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[5])
+    parser.add_argument('--levels', default='levels',
+                        help='directory with the level files')
+    parser.add_argument('--workers', type=int, help='worker processes')
+    parser.add_argument('--chunk', type=int, default=1000,
+                        help='sessions per job sent to a worker')
+    parser.add_argument('--seed', type=int, default=0, help='first seed')
+    parser.add_argument('--aim', type=float, default=2.0,
+                        help='spread of where the bot stops scrolling')
+    parser.add_argument('--reaction', type=int, default=400,
+                        help='mean ms the bot takes to click')
+    parser.add_argument('--heal-rate', type=float, default=0.5,
+                        help='floating hearts healed per second')
+    parser.add_argument('--json', help='also write the raw counters here')
+    args = parser.parse_args()
+    palettes = load_palettes(args.levels)
+    totals = run(palettes, args.lives, args.thresholds, args.sessions,
+                 args.workers, args.chunk, args.seed,
+                 {'aim': args.aim, 'reaction': args.reaction,
+                  'heal_rate': args.heal_rate})
+    report(palettes, totals)
+    if args.json:
+        Path(args.json).write_text(json.dumps(to_json(totals), indent=2))